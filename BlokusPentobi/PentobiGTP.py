@@ -1,47 +1,90 @@
+import functools
 import os
+import queue
 import random
+import shutil
 import subprocess
-import multiprocessing
+import threading
 from typing import List
 import numpy as np
-from .utils import parse_gtp_board_to_matrix, EmptyLock
+from .utils import (parse_blksgf_moves, move_to_bitmask, move_zobrist_delta,
+                    bitboards_to_matrix, BITBOARD_WORDS, EMPTY_BOARD_HASH, EmptyLock)
 
 
-# Contains shared GTP sessions, that are only used for generating moves
-_GTP_MOVE_SESSIONS = {}
+# The pass move, and the response of 'reg_genmove' when the player has to pass
+PASS = "pass"
+GTP_PASS = "="
 
-def get_pentobi_move_session(starting_kwargs = {}):
+# The path of the pentobi-gtp binary, once it has been searched for
+_PENTOBI_GTP_BINARY = None
+
+# Frequently sent commands, encoded once
+_ENCODED_COMMANDS = {
+    "showboard" : b"showboard\n",
+    "final_score" : b"final_score\n",
+    "undo" : b"undo\n",
+    "clear_board" : b"clear_board\n",
+    "all_legal 1" : b"all_legal 1\n",
+    "all_legal 2" : b"all_legal 2\n",
+    "all_legal 3" : b"all_legal 3\n",
+    "all_legal 4" : b"all_legal 4\n",
+}
+
+# The prefix of a 'play' command for each pid, and the pid of the next player for each pid
+_PLAY_PREFIXES = (None, b"play 1 ", b"play 2 ", b"play 3 ", b"play 4 ")
+_NEXT_PLAYER = (None, 2, 3, 4, 1)
+
+# The default arguments of a PentobiGTP session, and their order in a session key
+_DEFAULT_SESSION_KWARGS = {
+    "gtp_path" : None,
+    "level" : 1,
+    "book" : None,
+    "config" : None,
+    "game" : "classic",
+    "seed" : None,
+    "showboard" : False,
+    "nobook" : False,
+    "noresign" : True,
+    "threads" : 1,
+    "threadsafe" : True,
+}
+_DEFAULT_SESSION_KEYS = tuple(_DEFAULT_SESSION_KWARGS)
+
+def session_key(starting_kwargs) -> tuple:
+    """ Get a hashable key of the PentobiGTP arguments, where the missing arguments have their default values.
+    """
+    if not starting_kwargs.keys() <= _DEFAULT_SESSION_KWARGS.keys():
+        raise ValueError(f"Unknown PentobiGTP arguments: {set(starting_kwargs) - set(_DEFAULT_SESSION_KWARGS)}")
+    return tuple(starting_kwargs.get(k, _DEFAULT_SESSION_KWARGS[k]) for k in _DEFAULT_SESSION_KEYS)
+
+@functools.lru_cache(maxsize=None)
+def _get_move_session_pool(key, pool_size):
+    """ Get the shared pool of GTP sessions, that are only used for generating moves, for the session key.
+    """
+    #print(f"Created new PentobiGTP args: {key}")
+    return PentobiGTPPool(pool_size, **dict(zip(_DEFAULT_SESSION_KEYS, key)))
+
+def get_pentobi_move_session(starting_kwargs = {}, pool_size = 1):
     """ Get a shared PentobiGTP session, that is only used for generating moves.
+    The sessions with the same arguments are kept in a pool, and handed out in a round-robin fashion.
         Args:
             level (int): The level of the GTP session. If you are using players that match the level of the session,
             the players are faster.
             starting_kwargs (dict, optional): Additional keyword arguments for the GTP session. Defaults to {}.
+            pool_size (int, optional): The number of sessions in the pool for these arguments. Defaults to 1.
 
         Returns:
             PentobiGTP: The GTP session for generating moves with Pentobi.
     """
-    global _GTP_MOVE_SESSIONS
-    default_kwargs = {
-        "gtp_path" : None,
-        "level" : 1,
-        "book" : None,
-        "config" : None,
-        "game" : "classic",
-        "seed" : None,
-        "showboard" : False,
-        "nobook" : False,
-        "noresign" : True,
-        "threads" : 1,
-    }
-    # Create a hash from the starting kwargs, the order of the kwargs does not matter
-    starting_kwargs = {**default_kwargs, **starting_kwargs}
-    starting_kwargs_hash = hash(frozenset(starting_kwargs.items()))
-    if starting_kwargs_hash not in _GTP_MOVE_SESSIONS:
-        # We need to create a new session
-        sess = PentobiGTP(**starting_kwargs)
-        #print(f"Created new PentobiGTP args: {starting_kwargs}")
-        _GTP_MOVE_SESSIONS[starting_kwargs_hash] = sess
-    return _GTP_MOVE_SESSIONS[starting_kwargs_hash]
+    # The key does not depend on the order of the kwargs, or on whether the defaults are given explicitly
+    pool = _get_move_session_pool(session_key(starting_kwargs), pool_size)
+    return pool.get_session()
+
+def forget_move_sessions() -> None:
+    """ Forget the shared sessions for generating moves, without closing them, so new sessions are started when needed.
+    This is meant for forked worker processes, where the inherited sessions still belong to the parent process.
+    """
+    _get_move_session_pool.cache_clear()
 
 class PentobiGTP:
     """ Pentobi GTP interface wrapper.
@@ -59,6 +102,7 @@ class PentobiGTP:
                  nobook=False,
                  noresign=True,
                  threads=1,
+                 threadsafe=True,
                  ):
         """
         Starts a Pentobi GTP process and communicate with it.
@@ -73,6 +117,8 @@ class PentobiGTP:
             nobook (bool, optional): Whether to disable the opening book. Defaults to False.
             noresign (bool, optional): Whether to disable resigning. Defaults to True.
             threads (int, optional): The number of threads to use. Defaults to 1.
+            threadsafe (bool, optional): Whether the session can be used from multiple threads.
+                If False, the lock of the session does nothing, which is faster. Defaults to True.
         """
         
         if game != "classic":
@@ -82,31 +128,31 @@ class PentobiGTP:
         command = gtp_path if gtp_path else os.environ.get("PENTOBI_GTP")
         # Check that the command is not a valid file path
         if command is None or not os.path.isfile(command):
-            print(f"Command {command} is not a valid file path, searching from current directory...")
+            print(f"Command {command} is not a valid file path, searching for pentobi-gtp...")
             command = self._find_pentobi_gtp_binary()
             if command != None:
                 print(f"Found command: {command}")
             else:
                 raise ValueError("Pentobi GTP binary not found")
         self.level = level
-        # Build the command to start the pentobi-gtp process
+        # Build the command to start the pentobi-gtp process.
+        # The flags and their values are separate arguments, since the command is not run through a shell
         command = [command]
         if book:
-            command.append(f'--book {book}')
+            command.extend(['--book', str(book)])
         if config:
-            command.append(f'--config {config}')
-        command.append(f'--game {game}')
-        command.append(f'--level {level}')
+            command.extend(['--config', str(config)])
+        command.extend(['--game', str(game)])
+        command.extend(['--level', str(level)])
         if seed:
-            command.append(f'--seed {seed}')
+            command.extend(['--seed', str(seed)])
         if showboard:
             command.append('--showboard')
         if nobook:
             command.append('--nobook')
         if noresign:
             command.append('--noresign')
-        command.append(f'--threads {threads}')
-        command = ' '.join(command)
+        command.extend(['--threads', str(threads)])
         self.command = command
         #print(f"Starting pentobi-gtp with command: {command}")
         # Start the pentobi-gtp process in an invisible window
@@ -114,15 +160,42 @@ class PentobiGTP:
             command,
             stdin=subprocess.PIPE,
             stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            text=True,
-            bufsize=1,
-            shell=True,
+            # The log of the engine is discarded. A pipe that is never read would block the engine once it is full
+            stderr=subprocess.DEVNULL,
+            # The pipes are used through their file descriptors, so the file objects are not buffered
+            bufsize=0,
+            shell=False,
         )
+        # The commands are written directly to the file descriptor of stdin as ASCII bytes,
+        # and the responses are read directly from the file descriptor of stdout in large chunks.
+        # The data that has been read, but not yet returned, is kept in _rbuf, which is reused for all responses
+        self._stdin_fd = self.process.stdin.fileno()
+        self._stdout_fd = self.process.stdout.fileno()
+        self._rbuf = bytearray()
         self.previous_players = []
         self.current_player = 1
-        # Lock to ensure thread-safe access to the process
-        self.lock = multiprocessing.Lock()
+        # The (pid, move) pairs played so far, including passes.
+        self.move_history = []
+        # The number of passes in a row at the end of the game. The game is finished after four.
+        # The passes are not stored in .blksgf files, so after load_sgf the count is not exact until a move is played
+        self._consecutive_passes = 0
+        self._consecutive_passes_exact = True
+        # The passes are known for the moves from this index of the move history onwards
+        self._passes_known_from = 0
+        # The cells of each color (pid - 1) as bitboards, updated as moves are played
+        self._bitboards = np.zeros((4, BITBOARD_WORDS), dtype=np.uint64)
+        # The Zobrist hash of the board, updated as moves are played
+        self._board_hash = EMPTY_BOARD_HASH
+        # Incremented whenever the state of the game changes, to invalidate the cached query results
+        self._state_version = 0
+        self._moves_cache = {}
+        self._cached_board_text = None
+        self._cached_board = None
+        self._cached_score = None
+        self._cached_game_finished = None
+        # Lock to ensure thread-safe access to the process.
+        # The pipes of the process can not be shared between processes, so a thread lock is enough
+        self.lock = threading.Lock() if threadsafe else EmptyLock()
         # Send showboard to get the initial board state
         test = self.send_command("showboard")
         # Check that the process is running, and what is the output
@@ -131,43 +204,83 @@ class PentobiGTP:
         
     def _find_pentobi_gtp_binary(self) -> str:
         """
-        Finds the path to a file named 'pentobi-gtp'. Searches from the current directory.
+        Finds the path to a file named 'pentobi-gtp'.
+        Searches from PATH, and a few known directories, before searching the whole current directory.
+        The found path is cached for later sessions.
         """
-        # From the currect directory, search for the pentobi-gtp binary
+        global _PENTOBI_GTP_BINARY
+        if _PENTOBI_GTP_BINARY is not None:
+            return _PENTOBI_GTP_BINARY
         current_dir = os.getcwd()
-        for root, dirs, files in os.walk(current_dir):
-            for file in files:
-                print(file)
-                if file == "pentobi-gtp":
-                    pent_gtp = os.path.join(root, file)
-                    #os.environ["PENTOBI_GTP"] = pent_gtp
-                    return pent_gtp
-        return None
+        candidate_dirs = [current_dir, os.path.join(current_dir, "build"), os.path.join(current_dir, "bin")]
+        env_path = os.environ.get("PENTOBI_GTP")
+        if env_path:
+            candidate_dirs.append(os.path.dirname(env_path))
+        candidates = (os.path.join(d, "pentobi-gtp") for d in candidate_dirs)
+        pent_gtp = shutil.which("pentobi-gtp") or next((c for c in candidates if os.path.isfile(c)), None)
+        if pent_gtp is None:
+            # As a last resort, search the whole current directory for the pentobi-gtp binary
+            for root, dirs, files in os.walk(current_dir):
+                if "pentobi-gtp" in files:
+                    pent_gtp = os.path.join(root, "pentobi-gtp")
+                    break
+        _PENTOBI_GTP_BINARY = pent_gtp
+        return pent_gtp
     
     @property
     def board_as_text(self) -> str:
         """ The current board state as text
         """
-        return self.send_command("showboard")
+        cached = self._cached_board_text
+        if cached is not None and cached[0] == self._state_version:
+            return cached[1]
+        text = self.send_command("showboard")
+        self._cached_board_text = (self._state_version, text)
+        return text
     
     @property
     def board(self) -> np.ndarray:
-        """ The current board state as a numpy matrix
+        """ The current board state as a numpy matrix.
+        The board is built from the bitboards, so it does not require querying the GTP process.
+        """
+        cached = self._cached_board
+        if cached is None or cached[0] != self._state_version:
+            cached = (self._state_version, bitboards_to_matrix(self._bitboards))
+            self._cached_board = cached
+        # Return a copy, so that modifying the board does not corrupt the cache
+        return cached[1].copy()
+    
+    @property
+    def board_bits(self) -> np.ndarray:
+        """ The current board state as bitboards (uint64 array of shape (4, 7)).
+        Row i contains the cells of player i + 1, where bit (r * 20 + c) is the cell at row r and column c of the board matrix.
+        The returned array must not be modified.
+        """
+        return self._bitboards
+    
+    @property
+    def board_hash(self) -> int:
+        """ The Zobrist hash of the current board (see utils.zobrist_hash).
+        The hash is updated incrementally, so it does not require querying the GTP process.
         """
-        return parse_gtp_board_to_matrix(self.board_as_text)
+        return self._board_hash
     
     @property
     def score(self) -> List[int]:
         """ The current score of the game
         """
+        cached = self._cached_score
+        if cached is not None and cached[0] == self._state_version:
+            return list(cached[1])
         sc = self.send_command("final_score")
         #= 85 81 77 65
-        sc = sc.split(" ")
-        sc = [int(x) for x in sc[1:]]
+        # Skip the leading '=', and convert the scores in C with map
+        sc = list(map(int, sc.lstrip("=").split()))
         #if self.is_game_finished():
         #    winner_idx = np.argmax(sc)
         #    sc[winner_idx] += 50
-        return sc
+        self._cached_score = (self._state_version, sc)
+        return list(sc)
     
     def load_sgf(self, sgf_file, lock_process=True) -> None:
         """ Load a .blksgf file as the current state of the game.
@@ -177,6 +290,20 @@ class PentobiGTP:
             raise ValueError(f"File {sgf_file} not found")
         assert sgf_file.endswith(".blksgf"), "File must be a .blksgf file"
         self.send_command(f"loadsgf {sgf_file}", lock_process=lock_process)
+        # Keep the move history in sync with the loaded game, so the state can be copied
+        with open(sgf_file, "r") as f:
+            self.move_history = parse_blksgf_moves(f.read())
+        self.previous_players = [pid for pid, _ in self.move_history]
+        self._consecutive_passes = 0
+        self._consecutive_passes_exact = False
+        self._passes_known_from = len(self.move_history)
+        self._bitboards = np.zeros((4, BITBOARD_WORDS), dtype=np.uint64)
+        self._board_hash = EMPTY_BOARD_HASH
+        for pid, move in self.move_history:
+            if move != PASS:
+                self._bitboards[pid - 1] ^= move_to_bitmask(move)
+                self._board_hash ^= move_zobrist_delta(move, pid - 1)
+        self._bump_state_version()
         
     def save_sgf(self, sgf_file, overwrite=True, lock_process=True) -> None:
         """ Save the current state of the game to a .blksgf file.
@@ -187,21 +314,37 @@ class PentobiGTP:
         assert sgf_file.endswith(".blksgf"), "File must be a .blksgf file"
         self.send_command(f"savesgf {sgf_file}",lock_process=lock_process)
         
+    def clear_board(self, lock_process=True) -> None:
+        """ Clear the board, and start a new game from the first player.
+        """
+        self.send_command("clear_board", lock_process=lock_process)
+        self.move_history = []
+        self.previous_players = []
+        self.current_player = 1
+        self._consecutive_passes = 0
+        self._consecutive_passes_exact = True
+        self._passes_known_from = 0
+        self._bitboards = np.zeros((4, BITBOARD_WORDS), dtype=np.uint64)
+        self._board_hash = EMPTY_BOARD_HASH
+        self._bump_state_version()
+        
     def set_to_state(self, other, lock_process=True) -> None:
         """ Copy the state of the other PentobiGTP instance to this one
-        by saving the state of the other object to a file, and loading it.
-        The other object is not modified.
-        """
-        temp_file_path = str(hash(str(other.board))) + str(random.randint(0, 2**32-1)) + ".blksgf"
-        # Save the state of the other object to a file
-        other.save_sgf(temp_file_path, overwrite=True, lock_process=lock_process)
-        # Load the state of the other object to this object
-        self.load_sgf(temp_file_path, lock_process=lock_process)
+        by clearing the board, and replaying the move history of the other object.
+        The other object is not modified, and its process is not used.
+        """
+        self.clear_board(lock_process=lock_process)
+        commands = [f"play {pid} {move}" for pid, move in other.move_history if move != PASS]
+        self.send_commands_batch(commands, lock_process=lock_process)
+        self.move_history = list(other.move_history)
+        self.previous_players = list(other.previous_players)
         self.current_player = other.current_player
-        # Remove the temporary file
-        os.remove(temp_file_path)
-        
-        
+        self._consecutive_passes = other._consecutive_passes
+        self._consecutive_passes_exact = other._consecutive_passes_exact
+        self._passes_known_from = other._passes_known_from
+        self._bitboards = other._bitboards.copy()
+        self._board_hash = other._board_hash
+        self._bump_state_version()
         
     def send_command(self, command, raise_errors=True, lock_process=True) -> str:
         """
@@ -219,24 +362,88 @@ class PentobiGTP:
         lock = self.lock if lock_process else EmptyLock()
         with lock:
             # Send the command to the process
-            self.process.stdin.write(command + '\n')
-            self.process.stdin.flush()
+            data = _ENCODED_COMMANDS.get(command)
+            self._write(data if data is not None else (command + '\n').encode("ascii"))
             # Read the response from the process
             response = self._read_response()
             if "?" in response and raise_errors:
                 raise Exception(f"Command '{command}' failed: {response}")
         return response
 
+    def send_commands_batch(self, commands, raise_errors=True, lock_process=True) -> List[str]:
+        """
+        Sends multiple commands to the process with a single write, and returns the responses in order.
+        If you haven't already obtained the lock, then lock_process should be True, otherwise False.
+        Args:
+            commands (List[str]): The commands to send to the process.
+            raise_errors (bool): If True (default), raise an exception if any of the commands fail.
+        Returns:
+            List[str]: The responses from the process, one for each command.
+        Raises:
+            Exception: If a command fails and raise_errors is True.
+        """
+        if not commands:
+            return []
+        lock = self.lock if lock_process else EmptyLock()
+        with lock:
+            self._write(('\n'.join(commands) + '\n').encode("ascii"))
+            # The responses are in the same order as the commands.
+            # All responses must be read, even if one of them failed.
+            responses = [self._read_response() for _ in commands]
+        if raise_errors:
+            for command, response in zip(commands, responses):
+                if "?" in response:
+                    raise Exception(f"Command '{command}' failed: {response}")
+        return responses
+
+    def _write(self, data) -> None:
+        """ Write the bytes to the stdin of the process.
+        """
+        written = os.write(self._stdin_fd, data)
+        # A write to a pipe can be partial, if it is interrupted
+        while written < len(data):
+            written += os.write(self._stdin_fd, data[written:])
+
     def _read_response(self) -> str:
         """ Read the response (txt) from the process.
+        A response ends with an empty line. The output is read in large chunks,
+        and anything after the response is kept for the next call.
+        """
+        end = self._rbuf.find(b"\n\n")
+        while end == -1:
+            chunk = os.read(self._stdout_fd, 65536)
+            if not chunk:
+                # The process has exited, so return whatever is left
+                end = len(self._rbuf)
+                break
+            # The end of the response can be split between the previous data and the chunk
+            search_start = max(len(self._rbuf) - 1, 0)
+            self._rbuf += chunk
+            end = self._rbuf.find(b"\n\n", search_start)
+        response = self._rbuf[:end].decode()
+        # Deleting from the start of a bytearray does not reallocate it
+        del self._rbuf[:end + 2]
+        return response.strip()
+    
+    def _bump_state_version(self) -> None:
+        """ Mark the state of the game as changed, which invalidates the cached query results.
+        """
+        self._state_version += 1
+        self._moves_cache.clear()
+    
+    def _recount_consecutive_passes(self) -> None:
+        """ Count the passes at the end of the move history, after the last move was undone.
         """
-        response = []
-        while True:
-            line = self.process.stdout.readline().strip()
-            if line == '':
+        count = 0
+        # If the passes are known from the start of the game, the count is exact even without a move
+        exact = self._passes_known_from == 0
+        for idx in range(len(self.move_history) - 1, self._passes_known_from - 1, -1):
+            if self.move_history[idx][1] != PASS:
+                exact = True
                 break
-            response.append(line)
-        return '\n'.join(response)
+            count += 1
+        self._consecutive_passes = count
+        self._consecutive_passes_exact = exact
     
     def _check_pid_has_turn(self,pid) -> bool:
         """ Check if the player has the turn.
@@ -259,7 +466,7 @@ class PentobiGTP:
         out = self.send_command(f"reg_genmove {pid}", raise_errors=False, lock_process=lock_process)
         # = a1,b1 ...
         if "?" in out:
-            return "pass"
+            return PASS
         move = out.replace("= ", "")
         return move
     
@@ -268,10 +475,20 @@ class PentobiGTP:
         """
         if len(self.previous_players) == 0:
             return
-        out = self.send_command("undo", lock_process=lock_process)
-        if "?" in out:
-            raise ValueError("Undo failed")
+        # Passes are not sent to the GTP process, so they must not be undone there either
+        if not self.move_history or self.move_history[-1][1] != PASS:
+            out = self.send_command("undo", lock_process=lock_process)
+            if "?" in out:
+                raise ValueError("Undo failed")
+        if self.move_history:
+            pid, move = self.move_history.pop()
+            if move != PASS:
+                self._bitboards[pid - 1] ^= move_to_bitmask(move)
+                self._board_hash ^= move_zobrist_delta(move, pid - 1)
+            self._passes_known_from = min(self._passes_known_from, len(self.move_history))
+            self._recount_consecutive_passes()
         self.current_player = self.previous_players.pop()
+        self._bump_state_version()
     
     def play_move(self, pid, move, lock_process=True) -> bool:
         """ Play a move for the player with pid (Has to be in turn).
@@ -280,12 +497,40 @@ class PentobiGTP:
         """
         if not self._check_pid_has_turn(pid):
             raise ValueError(f"Player {pid} is not in turn!")
-        if move != "pass":
+        if move != PASS:
             self.send_command(f"play {pid} {move}", lock_process=lock_process)
-        self.previous_players.append(pid)
-        self._change_player(pid)
+        self._record_move(pid, move)
         return True
     
+    def play_current_player_move(self, move, lock_process=True) -> None:
+        """ Play a move for the current player, without checking the turn.
+        This is meant for loops that always play for the current player, such as random playouts.
+        """
+        pid = self.current_player
+        if move != PASS:
+            lock = self.lock if lock_process else EmptyLock()
+            with lock:
+                self._write(_PLAY_PREFIXES[pid] + move.encode("ascii") + b"\n")
+                response = self._read_response()
+            if "?" in response:
+                raise Exception(f"Command 'play {pid} {move}' failed: {response}")
+        self._record_move(pid, move)
+    
+    def _record_move(self, pid, move) -> None:
+        """ Update the state of this object after the move was played for the player with pid.
+        """
+        if move != PASS:
+            self._bitboards[pid - 1] ^= move_to_bitmask(move)
+            self._board_hash ^= move_zobrist_delta(move, pid - 1)
+            self._consecutive_passes = 0
+            self._consecutive_passes_exact = True
+        else:
+            self._consecutive_passes += 1
+        self.previous_players.append(pid)
+        self.move_history.append((pid, move))
+        self._bump_state_version()
+        self.current_player = _NEXT_PLAYER[pid]
+    
     def close(self, lock_process=True):
         """ Close the Pentobi GTP process.
         """
@@ -296,43 +541,174 @@ class PentobiGTP:
     
     def get_legal_moves(self, pid, lock_process=True) -> List[str]:
         """ Get a list of legal moves for the player with pid.
+        The moves are cached until the state of the game changes.
         """
-        out = self.send_command(f"all_legal {pid}", lock_process=lock_process)
-        moves = out.replace("=", "").split("\n")
-        moves = list(map(lambda mv : mv.strip(),filter(lambda x: x != "", moves)))
+        return list(self._get_cached_legal_moves(pid, lock_process=lock_process))
+    
+    def get_random_legal_move(self, pid, lock_process=True) -> str:
+        """ Get a uniformly random legal move for the player with pid, or 'pass' if there are no legal moves.
+        The move is picked from the cached legal moves, without copying them.
+        """
+        moves = self._get_cached_legal_moves(pid, lock_process=lock_process)
+        return moves[random.randrange(len(moves))]
+    
+    def _get_cached_legal_moves(self, pid, lock_process=True) -> List[str]:
+        """ Get the cached list of legal moves for the player with pid, querying them if they are not cached.
+        The returned list must not be modified.
+        """
+        key = (pid, self._state_version)
+        moves = self._moves_cache.get(key)
+        if moves is None:
+            out = self.send_command(f"all_legal {pid}", lock_process=lock_process)
+            moves = self._parse_legal_moves(out)
+            self._moves_cache[key] = moves
+        return moves
+    
+    @staticmethod
+    def _parse_legal_moves(out) -> List[str]:
+        """ Parse the response of an 'all_legal' command to a list of moves.
+        """
+        # = a1,b1 ...
+        # c3,d3 ...
+        # The moves do not contain whitespace, so a single split separates them
+        moves = out.lstrip("=").split()
         #print(f"Found moves: {moves}")
         if len(moves) == 0:
             #print(f"Player {pid} has no legal moves")
-            moves = ["pass"]
+            moves = [PASS]
         return moves
     
     def is_game_finished(self, lock_process=True) -> bool:
-        """ Check if the game is finished. The game is finished if no players have remaining legal moves.
+        """ Check if the game is finished. The game is finished when all four players have passed in a row,
+        since a player only passes when they have no legal moves.
+        If the passes are not known, because the state was loaded from a file,
+        the legal moves of all players are queried with a single batch of commands.
         """
-        for pid in range(1,5):
-            moves = self.get_legal_moves(pid, lock_process=lock_process)
+        if self._consecutive_passes >= 4:
+            return True
+        if self._consecutive_passes_exact:
+            return False
+        cached = self._cached_game_finished
+        if cached is not None and cached[0] == self._state_version:
+            return cached[1]
+        outs = self.send_commands_batch([f"all_legal {pid}" for pid in range(1,5)], lock_process=lock_process)
+        is_finished = True
+        for pid, out in zip(range(1,5), outs):
+            moves = self._parse_legal_moves(out)
+            self._moves_cache[(pid, self._state_version)] = moves
             # If the response is empty, the player has no legal moves
-            if len(moves) != 1 or moves[0] != "pass":
-                return False
-            else:
-                pass
-        return True
+            if len(moves) != 1 or moves[0] != PASS:
+                is_finished = False
+        self._cached_game_finished = (self._state_version, is_finished)
+        return is_finished
 
-if __name__ == "__main__":
-            
-    def random_playout(proc : PentobiGTP, state_file, start_pid):
-        """ Play a random game starting from the current state.
-        """
-        proc.send_command("clear_board")
-        proc._change_player(start_pid)
-        # Set the board to the state
-        proc.send_command("loadsgf " + state_file)
-        # Play random moves until the game is finished
-        while not proc.is_game_finished():
-            pid = proc.current_player
-            moves = proc.get_legal_moves(pid)
-            move = random.choice(moves)
-            proc.play_move(pid, move)
-        return proc.score
+class GTPStateCursor:
+    """ Walks the game tree with a single PentobiGTP session, by playing moves (push) and undoing them (pop).
+    Moving between nearby states like this is much cheaper than copying the states to other sessions with set_to_state.
+    """
+    def __init__(self, pentobi_sess : PentobiGTP):
+        """
+        Args:
+            pentobi_sess (PentobiGTP): The session to walk with. The current state of the session is the root.
+        """
+        self.pentobi_sess = pentobi_sess
+        # The (pid, move) pairs pushed since the root
+        self.stack = []
+        
+    @property
+    def depth(self) -> int:
+        """ The number of moves pushed since the root
+        """
+        return len(self.stack)
+        
+    def push(self, move, lock_process=True) -> None:
+        """ Play the move for the player in turn.
+        """
+        pid = self.pentobi_sess.current_player
+        self.pentobi_sess.play_move(pid, move, lock_process=lock_process)
+        self.stack.append((pid, move))
+        
+    def pop(self, lock_process=True):
+        """ Undo the last pushed move.
+        Returns:
+            Tuple[int, str]: The pid and the move that was undone.
+        """
+        if not self.stack:
+            raise IndexError("No moves to pop")
+        self.pentobi_sess.undo_last_move(lock_process=lock_process)
+        return self.stack.pop()
     
+    def rewind(self, lock_process=True) -> None:
+        """ Undo all the pushed moves, returning to the root.
+        """
+        while self.stack:
+            self.pop(lock_process=lock_process)
 
+class PentobiGTPPool:
+    """ A pool of PentobiGTP sessions with the same settings.
+    The work is distributed to the sessions with threads, one thread per session.
+    The threads mostly wait for the GTP processes, so the sessions work in parallel.
+    """
+    def __init__(self, n, **kwargs):
+        """
+        Starts n PentobiGTP sessions.
+        Args:
+            n (int): The number of sessions in the pool.
+            **kwargs: The keyword arguments for each PentobiGTP session.
+        """
+        if n < 1:
+            raise ValueError("The pool must have at least one session")
+        self.sessions = [PentobiGTP(**kwargs) for _ in range(n)]
+        self._next_session_idx = 0
+        self._next_session_lock = threading.Lock()
+        
+    def __len__(self) -> int:
+        return len(self.sessions)
+        
+    def get_session(self) -> PentobiGTP:
+        """ Get the next session from the pool, in a round-robin fashion.
+        """
+        with self._next_session_lock:
+            sess = self.sessions[self._next_session_idx]
+            self._next_session_idx = (self._next_session_idx + 1) % len(self.sessions)
+        return sess
+    
+    def map(self, func, items) -> List:
+        """ Call func(session, item) for each item, and return the results in the same order as the items.
+        Each session is used by one thread, which takes the next item as soon as the previous one is done.
+        The sessions should not be used elsewhere while the map is running.
+        Raises:
+            Exception: The first exception raised by func, after all the threads have finished.
+        """
+        items = list(items)
+        work = queue.Queue()
+        for idx, item in enumerate(items):
+            work.put((idx, item))
+        results = [None] * len(items)
+        errors = []
+        
+        def worker(sess):
+            while not errors:
+                try:
+                    idx, item = work.get_nowait()
+                except queue.Empty:
+                    return
+                try:
+                    results[idx] = func(sess, item)
+                except Exception as e:
+                    errors.append(e)
+        
+        threads = [threading.Thread(target=worker, args=(sess,)) for sess in self.sessions[:len(items)]]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if errors:
+            raise errors[0]
+        return results
+    
+    def close(self) -> None:
+        """ Close all the sessions in the pool.
+        """
+        for sess in self.sessions:
+            sess.close()
@@ -1,13 +1,45 @@
+from collections import OrderedDict
+import heapq
 import os
 import random
 from typing import List
 import warnings
 import numpy as np
 
-from .PentobiGTP import PentobiGTP, get_pentobi_move_session
+from .PentobiGTP import PentobiGTP, get_pentobi_move_session, PASS, GTP_PASS
+from .utils import move_to_cell_indices, move_zobrist_delta
+
+# Transposition table from (player class, pid, Zobrist hash of a board) to the evaluation of the board.
+# It is shared by all the players in the process, so the boards evaluated in earlier games are reused in later games
+_EVALUATION_CACHE = OrderedDict()
+
+def clear_evaluation_cache() -> None:
+    """ Remove all the cached board evaluations, for example after the evaluation of a player class has changed.
+    """
+    _EVALUATION_CACHE.clear()
+
+class _BasePlayer:
+    """ The initialization that is shared by the players.
+    """
+    _VALID_STRATEGIES = ("best", "random", "epsilon_greedy")
+    
+    def __init__(self, pid, pentobi_sess, move_selection_strategy, move_selection_kwargs, name):
+        self.pid = pid
+        self.pentobi_sess : PentobiGTP = pentobi_sess
+        self.name = name
+        if move_selection_strategy not in self._VALID_STRATEGIES:
+            raise ValueError(f"Invalid move selection strategy: {move_selection_strategy}")
+        if move_selection_strategy != "epsilon_greedy" and move_selection_kwargs:
+            raise ValueError(f"move_selection_kwargs should be empty for move_selection_strategy: {move_selection_strategy}")
+        self.move_selection_strategy = move_selection_strategy
+        # Copy the kwargs, so the default is not modified when epsilon is added
+        self.move_selection_kwargs = dict(move_selection_kwargs)
+        if move_selection_strategy == "epsilon_greedy" and "epsilon" not in move_selection_kwargs:
+            warnings.warn("No epsilon provided for epsilon_greedy move selection strategy. Defaulting to epsilon=0.1")
+            self.move_selection_kwargs["epsilon"] = 0.1
 
     
-class PentobiInternalPlayer:
+class PentobiInternalPlayer(_BasePlayer):
     def __init__(self,
                  pid : int,
                  pentobi_sess : PentobiGTP = None,
@@ -26,34 +58,25 @@ class PentobiInternalPlayer:
             move_selection_kwargs (dict, optional): Additional keyword arguments for the move selection strategy. Defaults to {}.
             name (str, optional): The name of the player. Defaults to "PentobiInternalPlayer".
         """
-        self.pid = pid
-        self.pentobi_sess : PentobiGTP = pentobi_sess
+        super().__init__(pid, pentobi_sess, move_selection_strategy, move_selection_kwargs, name)
         # We can provide a separate PentobiGTP session to get moves from a session with different (level) settings
         self.level = level
-        self.name = name
+        self.has_separate_pentobi_sess = self._uses_separate_pentobi_sess()
         self.move_pentobi_sess = self.get_move_pentobi_sess(level)
         
         #if get_move_pentobi_sess is None:
         #    self.get_move_pentobi_sess : PentobiGTP = pentobi_sess
             
-        self.move_selection_strategy = move_selection_strategy
-        self.move_selection_kwargs = move_selection_kwargs
-        assert move_selection_strategy in ["best", "random", "epsilon_greedy"], f"Invalid move selection strategy: {move_selection_strategy}"
-        
-        if move_selection_strategy != "epsilon_greedy":
-            assert not move_selection_kwargs, f"move_selection_kwargs should be empty for move_selection_strategy: {move_selection_strategy}"
-        
-        if move_selection_strategy == "epsilon_greedy" and "epsilon" not in move_selection_kwargs:
-            warnings.warn("No epsilon provided for epsilon_greedy move selection strategy. Defaulting to epsilon=0.1")
-            self.move_selection_kwargs["epsilon"] = 0.1
-            
     def set_pentobi_session(self, pentobi_sess):
         self.pentobi_sess = pentobi_sess
+        self.has_separate_pentobi_sess = self._uses_separate_pentobi_sess()
         self.move_pentobi_sess = self.get_move_pentobi_sess(self.level)
         return
     
-    @property
-    def has_separate_pentobi_sess(self):
+    def _uses_separate_pentobi_sess(self):
+        """ Whether the moves are generated in a separate session, because the level of the pentobi_sess is different.
+        This is stored in has_separate_pentobi_sess whenever the pentobi_sess is set.
+        """
         if self.pentobi_sess is None:
             return False
         return self.pentobi_sess.level != self.level
@@ -90,25 +113,31 @@ class PentobiInternalPlayer:
         """ Play a move using the pentobi_sess and the move_selection_strategy.
         """
         if self.move_selection_strategy == "random":
-            all_moves = self.pentobi_sess.get_legal_moves(self.pid)
-            selected_move = random.choice(all_moves)
+            selected_move = self.pentobi_sess.get_random_legal_move(self.pid)
         elif self.move_selection_strategy == "epsilon_greedy":
-            if np.random.rand() < self.move_selection_kwargs["epsilon"]:
-                all_moves = self.pentobi_sess.get_legal_moves(self.pid)
-                selected_move = random.choice(all_moves)
+            if random.random() < self.move_selection_kwargs["epsilon"]:
+                selected_move = self.pentobi_sess.get_random_legal_move(self.pid)
             else:
                 selected_move = self._make_move_with_pentobi_sess()
         elif self.move_selection_strategy == "best":
             selected_move = self._make_move_with_pentobi_sess()
         #print(f"Player {self.pid} chose move: {selected_move}", flush=True)
-        if selected_move == "=":
-            selected_move = "pass"
+        if selected_move == GTP_PASS:
+            selected_move = PASS
         self.pentobi_sess.play_move(self.pid, selected_move)
         return
     
 
 
-class PentobiExternalPlayer:
+class PentobiExternalPlayer(_BasePlayer):
+    # The maximum number of board evaluations kept in the shared transposition table, when this class adds to it.
+    # The table is disabled (0) by default, since evaluate_board may depend on more than the board,
+    # for example on model weights that change between games. Enable it only if it depends on the board alone.
+    EVALUATION_CACHE_SIZE = 0
+    # The number of the largest pieces that are evaluated when choosing the best move.
+    # None evaluates all the moves. Only set this if the evaluation can not prefer a smaller piece over a larger one.
+    CANDIDATE_MOVE_LIMIT = None
+    
     def __init__(self,
                  pid : int,
                  pentobi_sess : PentobiGTP,
@@ -119,6 +148,8 @@ class PentobiExternalPlayer:
         """ Initializes a PentobiExternalPlayer object.
         This player can play moves using simple external evaluation functions or heuristics.
         A custom player can be created by inheriting from this class and implementing the evaluate_board method.
+        If EVALUATION_CACHE_SIZE > 0, the evaluations are cached by the class, the pid and the Zobrist hash of the board,
+        so they are reused when any player of the same class and pid sees the board again in this process.
         Args:
             pid (int): The player ID.
             pentobi_sess (PentobiGTP): A PentobiGTP session to play moves with.
@@ -126,19 +157,7 @@ class PentobiExternalPlayer:
             move_selection_kwargs (dict, optional): Additional keyword arguments for the move selection strategy. Defaults to {}.
             name (str, optional): The name of the player. Defaults to "PentobiExternalPlayer".
         """
-        self.pid = pid
-        self.pentobi_sess : PentobiGTP = pentobi_sess
-        self.name = name
-        self.move_selection_strategy = move_selection_strategy
-        self.move_selection_kwargs = move_selection_kwargs
-        assert move_selection_strategy in ["best", "random", "epsilon_greedy"], f"Invalid move selection strategy: {move_selection_strategy}"
-        
-        if move_selection_strategy != "epsilon_greedy":
-            assert not move_selection_kwargs, f"move_selection_kwargs should be empty for move_selection_strategy: {move_selection_strategy}"
-            
-        if move_selection_strategy == "epsilon_greedy" and "epsilon" not in move_selection_kwargs:
-            warnings.warn("No epsilon provided for epsilon_greedy move selection strategy. Defaulting to epsilon=0.1")
-            self.move_selection_kwargs["epsilon"] = 0.1
+        super().__init__(pid, pentobi_sess, move_selection_strategy, move_selection_kwargs, name)
             
     def evaluate_board(self, board):
         """ This method returns a numeric value for the board state.
@@ -147,29 +166,60 @@ class PentobiExternalPlayer:
         this player has just played a move, and it is the opponent's turn.
         """
         raise NotImplementedError("evaluate_board method not implemented")
+    
+    def _evaluate_next_state(self, board, board_hash, move):
+        """ Evaluate the board after this player plays 'move' on 'board', whose Zobrist hash is board_hash.
+        The next board is only built if its evaluation is not in the transposition table.
+        If the table is disabled, board_hash is not used.
+        """
+        if self.EVALUATION_CACHE_SIZE <= 0:
+            return self.evaluate_board(self._next_state(board, move))
+        key = (type(self), self.pid, board_hash ^ move_zobrist_delta(move, self.pid - 1))
+        value = _EVALUATION_CACHE.get(key)
+        if value is None:
+            value = self.evaluate_board(self._next_state(board, move))
+            if len(_EVALUATION_CACHE) >= self.EVALUATION_CACHE_SIZE:
+                # Drop the oldest entry
+                _EVALUATION_CACHE.popitem(last=False)
+            _EVALUATION_CACHE[key] = value
+        return value
+    
+    def _next_state(self, board, move) -> np.ndarray:
+        """ Get a copy of the board, where this player has placed the move.
+        """
+        next_board = board.copy()
+        next_board.flat[move_to_cell_indices(move)] = self.pid - 1
+        return next_board
 
 
     def calc_next_states(self, moves, lock_process=True) -> List[np.ndarray]:
         """ Calculate the next states of the board after playing each move in 'moves'.
+        The moves are placed on copies of the current board locally, so the GTP process is not used.
         """
-        next_states = []
-        for move in moves:
-            if move == "pass":
-                continue
-            self.pentobi_sess.play_move(self.pid, move, lock_process=lock_process)
-            board = self.pentobi_sess.board
-            next_states.append(board)
-            self.pentobi_sess.undo_last_move(lock_process=lock_process)
-        return next_states
+        board = self.pentobi_sess.board
+        return [self._next_state(board, move) for move in moves if move != PASS]
 
 
     def _make_move_with_external_player(self, moves, lock_process=True):
         """ Make a move using the external player evaluation function.
         """
-        next_states = self.calc_next_states(moves, lock_process=lock_process)
-        values = [self.evaluate_board(board) for board in next_states]
-        best_move_idx = np.argmax(values)
-        return moves[best_move_idx]
+        candidate_moves = [move for move in moves if move != PASS]
+        if not candidate_moves:
+            return PASS
+        if self.CANDIDATE_MOVE_LIMIT is not None and len(candidate_moves) > self.CANDIDATE_MOVE_LIMIT:
+            # The number of cells in a move is the number of commas + 1.
+            # Moves of the same size keep their order, so the first best move is the same as without the limit
+            candidate_moves = heapq.nlargest(self.CANDIDATE_MOVE_LIMIT, candidate_moves, key=lambda move: move.count(","))
+        board = self.pentobi_sess.board
+        board_hash = self.pentobi_sess.board_hash if self.EVALUATION_CACHE_SIZE > 0 else None
+        # Keep the first move with the highest value, without collecting the values
+        best_move = candidate_moves[0]
+        best_value = self._evaluate_next_state(board, board_hash, best_move)
+        for move in candidate_moves[1:]:
+            value = self._evaluate_next_state(board, board_hash, move)
+            if value > best_value:
+                best_move, best_value = move, value
+        return best_move
     
     
     def play_move(self):
@@ -181,29 +231,42 @@ class PentobiExternalPlayer:
         
         # We can get the lock once here, and set lock_process = False for the rest of the calls
         with self.pentobi_sess.lock:
-            all_moves = self.pentobi_sess.get_legal_moves(self.pid, lock_process=False)
+            # A random move is picked without copying the list of legal moves
             if self.move_selection_strategy == "random":
-                selected_move = random.choice(all_moves)
+                selected_move = self.pentobi_sess.get_random_legal_move(self.pid, lock_process=False)
             elif self.move_selection_strategy == "epsilon_greedy":
-                if np.random.rand() < self.move_selection_kwargs["epsilon"]:
-                    selected_move = random.choice(all_moves)
+                if random.random() < self.move_selection_kwargs["epsilon"]:
+                    selected_move = self.pentobi_sess.get_random_legal_move(self.pid, lock_process=False)
                 else:
+                    all_moves = self.pentobi_sess.get_legal_moves(self.pid, lock_process=False)
                     selected_move = self._make_move_with_external_player(all_moves, lock_process=False)
             elif self.move_selection_strategy == "best":
+                all_moves = self.pentobi_sess.get_legal_moves(self.pid, lock_process=False)
                 selected_move = self._make_move_with_external_player(all_moves, lock_process=False)
-            if selected_move == "=":
-                selected_move = "pass"
+            if selected_move == GTP_PASS:
+                selected_move = PASS
             self.pentobi_sess.play_move(self.pid, selected_move, lock_process=False)
         return
     
 class GreedyExternalPlayer(PentobiExternalPlayer):
     """ A simple external player that plays the move that maximizes the number of pieces of the player
-    and minimizes the number of pieces of the opponent.
+    and minimizes the number of pieces of the opponents.
+    A move adds as many cells to the player as the piece has, and none to the opponents,
+    so a larger piece always has a higher value, and only the largest pieces need to be evaluated.
     """
+    CANDIDATE_MOVE_LIMIT = 20
+    # The evaluation only depends on the board, so the evaluations can be cached
+    EVALUATION_CACHE_SIZE = 2**20
+    
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # The color of the player on the board (pid - 1) as an int8 scalar, so it matches the dtype of the board
+        self._color_i8 = np.int8(self.pid - 1)
+    
     def evaluate_board(self, board):
-        """ Evaluate the board by counting the number of pieces of the player and the opponent.
+        """ Evaluate the board by counting the cells of the player and the cells of the opponents.
         """
-        player_count = np.sum(board == self.pid)
-        opponent_count = np.sum(board == 4 - self.pid)
+        player_count = np.count_nonzero(board == self._color_i8)
+        opponent_count = np.count_nonzero(board >= 0) - player_count
         return player_count - opponent_count
             
\ No newline at end of file
@@ -1,5 +1,62 @@
+from collections import OrderedDict
+import hashlib
+import multiprocessing
+import os
+import pickle
+import queue
 import time
-from .PentobiGTP import PentobiGTP
+from typing import List, Tuple
+import numpy as np
+from .PentobiGTP import PentobiGTP, session_key, forget_move_sessions
+
+# The timeout of a game is checked every this many moves
+_TIMEOUT_CHECK_INTERVAL = 4
+
+# Mean scores of random playouts, keyed by (digest of the state file, start pid, number of playouts).
+# The least recently used entries are dropped when the cache is full
+_PLAYOUT_SCORE_CACHE = OrderedDict()
+PLAYOUT_SCORE_CACHE_SIZE = 100_000
+
+# Idle PentobiGTP sessions of finished games, keyed by the session key of their arguments.
+# Reusing a session avoids starting a new Pentobi process for every game
+_GAME_SESSION_POOLS = {}
+
+def _game_session_kwargs(game_kwargs) -> dict:
+    """ Get the arguments of a game session. A game is played from a single thread,
+    so the sessions do not lock their process, unless 'threadsafe' is given.
+    """
+    return {"threadsafe" : False, **game_kwargs}
+
+def acquire_game_session(game_kwargs) -> PentobiGTP:
+    """ Get a PentobiGTP session with a cleared board for a new game.
+    An idle session with the same arguments is reused if there is one, otherwise a new session is started.
+    A reused session does not restart its random generator from the 'seed' argument,
+    so seeded games are only reproducible as a sequence of games in the same process, not one by one.
+    The session is not threadsafe, unless game_kwargs sets 'threadsafe'.
+    """
+    game_kwargs = _game_session_kwargs(game_kwargs)
+    idle_sessions = _GAME_SESSION_POOLS.setdefault(session_key(game_kwargs), queue.Queue())
+    try:
+        game = idle_sessions.get_nowait()
+    except queue.Empty:
+        return PentobiGTP(**game_kwargs)
+    game.clear_board()
+    return game
+
+def release_game_session(game, game_kwargs) -> None:
+    """ Return a session from acquire_game_session to the pool, so it can be reused by a later game.
+    The session must not be used after it has been released.
+    """
+    game_kwargs = _game_session_kwargs(game_kwargs)
+    _GAME_SESSION_POOLS.setdefault(session_key(game_kwargs), queue.Queue()).put(game)
+
+def close_game_sessions() -> None:
+    """ Close all the idle sessions in the pool.
+    """
+    for idle_sessions in _GAME_SESSION_POOLS.values():
+        while not idle_sessions.empty():
+            idle_sessions.get_nowait().close()
+    _GAME_SESSION_POOLS.clear()
 
 def play_game(players, game, verbose=False, timeout=60) -> PentobiGTP:
     """
@@ -17,11 +74,17 @@ def play_game(players, game, verbose=False, timeout=60) -> PentobiGTP:
     for player in players:
         player.set_pentobi_session(game)
     
-    start_time = time.time()
-    while not game.is_game_finished() and time.time() - start_time < timeout:
-        # Get the current player
-        player = players[game.current_player - 1]
-        player.play_move()
+    # Bind the methods called every move to local names. The moves of the players are indexed by pid
+    play_moves = (None, *(player.play_move for player in players))
+    is_game_finished = game.is_game_finished
+    deadline = time.monotonic() + timeout
+    n_moves = 0
+    while not is_game_finished():
+        if n_moves % _TIMEOUT_CHECK_INTERVAL == 0 and time.monotonic() >= deadline:
+            break
+        # Play the move of the current player
+        play_moves[game.current_player]()
+        n_moves += 1
         if verbose:
             print(game.board_as_text)
     return game
@@ -29,6 +92,7 @@ def play_game(players, game, verbose=False, timeout=60) -> PentobiGTP:
 def play_game_with_args(players, game_kwargs, verbose=False, timeout=60) -> PentobiGTP:
     """
     Given a list of players and the initialization arguments for the game, play the game.
+    The game is played in a session from acquire_game_session, which can be given back with release_game_session.
     Args:
         players: A list of players participating in the game.
         game_kwargs: Keyword arguments for configuring the game.
@@ -38,7 +102,7 @@ def play_game_with_args(players, game_kwargs, verbose=False, timeout=60) -> Pent
     Returns:
         game: The PentobiGTP object representing the game.
     """
-    game = PentobiGTP(**game_kwargs)
+    game = acquire_game_session(game_kwargs)
     return play_game(players, game, verbose, timeout)
 
 def play_game_with_args_and_save_result(players, game_kwargs, verbose=False, timeout=60, result_file="result.blksgf") -> PentobiGTP:
@@ -60,4 +124,125 @@ def play_game_with_args_and_save_result(players, game_kwargs, verbose=False, tim
     game.save_sgf(result_file)
     return game
 
-    
+def play_game_from_spec(players_spec, game_kwargs, result_file=None, verbose=False, timeout=60) -> List[int]:
+    """
+    Create the players and the game, play the game, and optionally save the result.
+    This function and its arguments can be pickled, so it can be run in a worker process.
+    The session of the game is returned to the pool afterwards, so later games in the same process reuse it.
+    If the game fails, its Pentobi process is killed instead, so failed games do not leave processes behind.
+
+    Args:
+        players_spec: A list of (player_class, player_kwargs) tuples, one for each player.
+        game_kwargs: Keyword arguments for configuring the game.
+        result_file: File path to save the result in SGF format. If None, the result is not saved. Defaults to None.
+        verbose: Whether to print verbose output during the game. Defaults to False.
+        timeout: Maximum time allowed for the game in seconds. Defaults to 60.
+
+    Returns:
+        List[int]: The final score of the game.
+    """
+    players = [player_class(**player_kwargs) for player_class, player_kwargs in players_spec]
+    game = acquire_game_session(game_kwargs)
+    try:
+        play_game(players, game, verbose, timeout)
+        if result_file is not None:
+            game.save_sgf(result_file)
+        score = game.score
+    except BaseException:
+        # The session may have failed in the middle of a command, so it is not reused.
+        # The process is killed, since it may not respond to 'quit'
+        game.process.kill()
+        game.process.wait()
+        raise
+    release_game_session(game, game_kwargs)
+    return score
+
+def _init_game_worker() -> None:
+    """ Limit the threads of the libraries in a worker process, so the workers do not oversubscribe the cores.
+    """
+    os.environ["CUDA_VISIBLE_DEVICES"] = ""
+    os.environ["OMP_NUM_THREADS"] = "1"
+    # The sessions inherited from the parent process share its Pentobi processes, so they must not be reused.
+    # They are forgotten without closing them, since the parent still uses them
+    _GAME_SESSION_POOLS.clear()
+    forget_move_sessions()
+
+def play_games_in_parallel(games, n_workers=None, maxtasksperchild=None) -> List[List[int]]:
+    """
+    Play games in parallel worker processes. Each worker reuses its PentobiGTP sessions between games.
+
+    Args:
+        games: A list of (players_spec, game_kwargs, result_file) tuples. See play_game_from_spec.
+        n_workers: The number of worker processes. Defaults to None, which uses the number of CPUs.
+        maxtasksperchild: The number of games a worker plays before it is replaced,
+            which releases its resources. Defaults to None, which keeps the workers for all the games.
+
+    Returns:
+        List[List[int]]: The final scores of the games, in the same order as the games.
+    """
+    with multiprocessing.Pool(n_workers, initializer=_init_game_worker, maxtasksperchild=maxtasksperchild) as pool:
+        return pool.starmap(play_game_from_spec, games)
+
+def random_playout(proc : PentobiGTP, state_file, start_pid) -> List[int]:
+    """ Play a random game starting from the state in state_file.
+    start_pid is the player who played the last move of the state, so the player after start_pid moves first.
+    Returns:
+        List[int]: The final score of the game.
+    """
+    proc.clear_board()
+    # Set the board to the state
+    proc.load_sgf(state_file)
+    # The player after start_pid is in turn
+    proc.current_player = (start_pid % 4) + 1
+    # Play random moves until the game is finished
+    while not proc.is_game_finished():
+        move = proc.get_random_legal_move(proc.current_player)
+        proc.play_current_player_move(move)
+    return proc.score
+
+def mean_random_playout_scores(proc : PentobiGTP, state_file, start_pid, n_playouts=1) -> Tuple[float, ...]:
+    """ Get the mean scores of n_playouts random playouts starting from the state in state_file.
+    The result is cached by the contents of the state file, so revisiting a state does not play the games again.
+    Args:
+        proc: The PentobiGTP session to play the games with.
+        state_file: The .blksgf file with the starting state.
+        start_pid: The player who played the last move of the starting state. The next player moves first.
+        n_playouts: The number of games to play. Defaults to 1.
+    Returns:
+        Tuple[float, ...]: The mean score of each player.
+    """
+    with open(state_file, "rb") as f:
+        digest = hashlib.blake2b(f.read(), digest_size=16).digest()
+    key = (digest, start_pid, n_playouts)
+    scores = _PLAYOUT_SCORE_CACHE.get(key)
+    if scores is not None:
+        # Mark the key as the most recently used
+        _PLAYOUT_SCORE_CACHE.move_to_end(key)
+        return scores
+    all_scores = [random_playout(proc, state_file, start_pid) for _ in range(n_playouts)]
+    scores = tuple(float(sc) for sc in np.mean(all_scores, axis=0))
+    if len(_PLAYOUT_SCORE_CACHE) >= PLAYOUT_SCORE_CACHE_SIZE:
+        # Drop the least recently used entry
+        _PLAYOUT_SCORE_CACHE.popitem(last=False)
+    _PLAYOUT_SCORE_CACHE[key] = scores
+    return scores
+
+def clear_playout_score_cache() -> None:
+    """ Remove all the cached playout scores.
+    """
+    _PLAYOUT_SCORE_CACHE.clear()
+
+def save_playout_score_cache(file_path) -> None:
+    """ Save the cached playout scores to a pickle file, so they can be reused in later runs.
+    """
+    with open(file_path, "wb") as f:
+        pickle.dump(_PLAYOUT_SCORE_CACHE, f)
+
+def load_playout_score_cache(file_path) -> None:
+    """ Add the playout scores from a pickle file saved with save_playout_score_cache to the cache.
+    If the cache is then over PLAYOUT_SCORE_CACHE_SIZE, the least recently used entries are dropped.
+    """
+    with open(file_path, "rb") as f:
+        _PLAYOUT_SCORE_CACHE.update(pickle.load(f))
+    while len(_PLAYOUT_SCORE_CACHE) > PLAYOUT_SCORE_CACHE_SIZE:
+        _PLAYOUT_SCORE_CACHE.popitem(last=False)
@@ -1,8 +1,39 @@
+import re
 import numpy as np
 
+_BLKSGF_MOVE_PATTERN = re.compile(r";([1-4])\[([^\]]*)\]")
+
+BOARD_SIZE = 20
+# Each color is stored as 400 bits packed into 7 64-bit words
+BITBOARD_WORDS = 7
+
+# Maps the characters of the board (as bytes) to the values of the cells.
+# Empty cells ('.') and starting points ('+') are -1, and the colors are 0 to 3
+_CELL_VALUE_LUT = np.full(256, -1, dtype=np.int8)
+for _value, _char in enumerate("XO#@"):
+    _CELL_VALUE_LUT[ord(_char)] = _value
+
+# The lines of the rows in the 'showboard' output, and the cells in a row line.
+# The cells are every other character after the row number and the separator after it.
+# The row number has two characters, or one character if the rows are not padded (' 9' or '9')
+_BOARD_ROW_LINES = slice(1, BOARD_SIZE + 1)
+_PADDED_ROW_CELLS = slice(3, 3 + 2 * BOARD_SIZE - 1, 2)
+_UNPADDED_ROW_CELLS = slice(2, 2 + 2 * BOARD_SIZE - 1, 2)
+
+# Random keys for Zobrist hashing, one for each (cell, cell value + 1) pair.
+# The seed is fixed, so the hashes are the same in every process
+ZOBRIST_KEYS = np.random.default_rng(0).integers(0, 2**63, size=(BOARD_SIZE * BOARD_SIZE, 5), dtype=np.int64)
+_ZOBRIST_CELLS = np.arange(BOARD_SIZE * BOARD_SIZE)
+EMPTY_BOARD_HASH = int(np.bitwise_xor.reduce(ZOBRIST_KEYS[:, 0]))
+
+# Moves repeat a lot during a game, so their parsed forms are cached
+_MOVE_CELL_INDICES = {}
+_MOVE_BITMASKS = {}
+_MOVE_ZOBRIST_DELTAS = {}
+
 def parse_gtp_board_to_matrix(board):
     """
-    Parse the board as printed by the GTP engine to a numpy matrix.
+    Parse the board as printed by the GTP engine to a numpy matrix of type int8.
     
     Example:
     20 X X . X O O O O # # # # X X X X X . . O  Blue(X): 82!
@@ -27,35 +58,95 @@ def parse_gtp_board_to_matrix(board):
     1 @ # . . . @ @ @ @ O O . O . @ . @ . . #
     A B C D E F G H I J K L M N O P Q R S T
     """
-    # Substitute > or < with a space
-    board = board.replace(">", " ").replace("<", " ")
-    board_in_lines = board.split("\n")
-    board_in_lines = board_in_lines[1:-1]
-    board_in_lines_splitted = [line.split(" ") for line in board_in_lines]
-    # remove empty elements
-    board_in_lines_splitted = [list(filter(lambda x: x != "", line)) for line in board_in_lines_splitted]
-    #print(board_in_lines_splitted)
+    # Skip the first line, and take the 20 rows of the board
+    board_in_lines = board.split("\n", BOARD_SIZE + 1)[_BOARD_ROW_LINES]
+    # Take the cells of each row with the precomputed slices. The '>' and '<' that mark the last move
+    # are in the separators between the cells, so they are never read
+    cells = "".join([line[_PADDED_ROW_CELLS] if line[0] == " " or line[1].isdigit() else line[_UNPADDED_ROW_CELLS]
+                     for line in board_in_lines])
+    # Convert all the cells at once with the lookup table
+    cells = np.frombuffer(cells.encode("ascii"), dtype=np.uint8)
+    return _CELL_VALUE_LUT[cells].reshape(BOARD_SIZE, BOARD_SIZE)
+
+def parse_blksgf_moves(sgf_text):
+    """
+    Parse the moves from the contents of a .blksgf file.
+    
+    Example:
+    (
+    ;GM[Blokus]
+    ;1[c18,c19,a20,b20,c20]
+    ;2[r18,s18,s19,s20,t20]
+    ...
+    )
+    
+    Returns:
+        List[Tuple[int, str]]: The (pid, move) pairs in the order they were played.
+    """
+    return [(int(pid), move) for pid, move in _BLKSGF_MOVE_PATTERN.findall(sgf_text)]
+
+def move_to_cell_indices(move) -> np.ndarray:
+    """
+    Convert a move, e.g. 'a1,b1,b2', to the flat indices of its cells in a (20, 20) board matrix.
+    The first row of the matrix is row 20 of the board, and the first column is column 'a'.
+    The returned array is shared between calls, and must not be modified.
+    """
+    indices = _MOVE_CELL_INDICES.get(move)
+    if indices is None:
+        indices = []
+        for cell in move.split(","):
+            col = ord(cell[0]) - ord("a")
+            row = BOARD_SIZE - int(cell[1:])
+            indices.append(row * BOARD_SIZE + col)
+        indices = np.array(indices, dtype=np.int64)
+        indices.setflags(write=False)
+        _MOVE_CELL_INDICES[move] = indices
+    return indices
 
-    # Skip the row number, and only take the first 20 columns
-    for i in range(0, len(board_in_lines_splitted)):
-        #print(board_in_lines_splitted[i])
-        board_in_lines_splitted[i] = board_in_lines_splitted[i][1:21]
-        #print(board_in_lines_splitted[i])
-    # Remove the last row
-    #board_in_lines_splitted = board_in_lines_splitted[:-1]
-    #print(board_in_lines_splitted)
-    conversion_map = {
-        "." : -1,
-        "X" : 0,
-        "O" : 1,
-        "#" : 2,
-        "@" : 3,
-        "+" : -1,
-    }
-    board_matrix = []
-    for line in board_in_lines_splitted:
-        board_matrix.append([conversion_map[x] for x in line])
-    return np.array(board_matrix)
+def move_to_bitmask(move) -> np.ndarray:
+    """
+    Convert a move, e.g. 'a1,b1,b2', to a bitboard (uint64 array of length 7),
+    where the bits of the cells of the move are set.
+    The returned array is shared between calls, and must not be modified.
+    """
+    mask = _MOVE_BITMASKS.get(move)
+    if mask is None:
+        bits = np.zeros(BITBOARD_WORDS * 64, dtype=np.uint8)
+        bits[move_to_cell_indices(move)] = 1
+        mask = np.packbits(bits, bitorder="little").view("<u8").astype(np.uint64)
+        mask.setflags(write=False)
+        _MOVE_BITMASKS[move] = mask
+    return mask
+
+def zobrist_hash(board) -> int:
+    """
+    Compute the Zobrist hash of a board matrix of shape (20, 20),
+    where empty cells are -1 and the other cells are the index of the color.
+    """
+    return int(np.bitwise_xor.reduce(ZOBRIST_KEYS[_ZOBRIST_CELLS, board.ravel() + 1]))
+
+def move_zobrist_delta(move, color) -> int:
+    """
+    Get the value, that is XORed to the Zobrist hash of a board, when the color places the move on the board,
+    or when the move is removed from the board.
+    """
+    key = (move, color)
+    delta = _MOVE_ZOBRIST_DELTAS.get(key)
+    if delta is None:
+        cells = move_to_cell_indices(move)
+        delta = int(np.bitwise_xor.reduce(ZOBRIST_KEYS[cells, 0] ^ ZOBRIST_KEYS[cells, color + 1]))
+        _MOVE_ZOBRIST_DELTAS[key] = delta
+    return delta
+
+def bitboards_to_matrix(bitboards) -> np.ndarray:
+    """
+    Convert the bitboards (uint64 array of shape (4, 7)) of the four colors to a board matrix
+    of shape (20, 20) and type int8, where empty cells are -1 and the other cells are the index of the color.
+    """
+    bits = np.unpackbits(bitboards.astype("<u8").view(np.uint8), bitorder="little")
+    bits = bits.reshape(4, BITBOARD_WORDS * 64)[:, :BOARD_SIZE * BOARD_SIZE]
+    board = np.where(bits.any(axis=0), bits.argmax(axis=0), -1).astype(np.int8)
+    return board.reshape(BOARD_SIZE, BOARD_SIZE)
 
 class EmptyLock:
     """ A dummy lock that does nothing
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+""" A small stand-in for the pentobi-gtp binary, so the GTP session can be tested without Pentobi.
+It speaks the same protocol for the commands that PentobiGTP sends, with much simpler rules:
+a move is a line of 1 or 3 free cells on the cells where (column + row + pid) % 7 == 0,
+and each player can place STUB_PENTOBI_PIECES pieces (default 3), after which they can only pass.
+The extra command 'stub_echo N' responds with N characters, to test responses that do not fit in one read.
+"""
+import os
+import re
+import sys
+
+COLUMNS = "abcdefghijklmnopqrst"
+COLORS = "XO#@"
+PIECES_PER_PLAYER = int(os.environ.get("STUB_PENTOBI_PIECES", "3"))
+
+# The pid of the piece in each occupied (column, row) cell, and the played (pid, move) pairs
+board = {}
+history = []
+
+def move_cells(move):
+    return [(COLUMNS.index(cell[0]), int(cell[1:])) for cell in move.split(",")]
+
+def legal_moves(pid):
+    if sum(1 for p, _ in history if p == pid) >= PIECES_PER_PLAYER:
+        return []
+    moves = []
+    for row in range(1, 21):
+        for col in range(18):
+            for size in (1, 3):
+                cells = [(col + i, row) for i in range(size)]
+                if (col + row + pid) % 7 == 0 and all(cell not in board for cell in cells):
+                    moves.append(",".join(f"{COLUMNS[c]}{r}" for c, r in cells))
+    return moves
+
+def place(pid, move):
+    for cell in move_cells(move):
+        board[cell] = pid
+    history.append((pid, move))
+
+def show_board():
+    last_cells = set(move_cells(history[-1][1])) if history else set()
+    lines = [""]
+    for row in range(20, 0, -1):
+        line = f"{row:2d}"
+        for col in range(20):
+            pid = board.get((col, row))
+            line += (">" if (col, row) in last_cells else " ") + (COLORS[pid - 1] if pid else ".")
+        if row == 20:
+            line += "  Blue(X): 0"
+        lines.append(line)
+    lines.append("   A B C D E F G H I J K L M N O P Q R S T")
+    return "\n".join(lines)
+
+def respond(ok, text=""):
+    sys.stdout.write(("= " if ok else "? ") + text + "\n\n")
+    sys.stdout.flush()
+
+for line in sys.stdin:
+    parts = line.split()
+    if not parts:
+        continue
+    command, args = parts[0], parts[1:]
+    if command == "play":
+        pid, move = int(args[0]), args[1]
+        if move not in legal_moves(pid):
+            respond(False, "illegal move")
+            continue
+        place(pid, move)
+        respond(True)
+    elif command == "undo":
+        if not history:
+            respond(False, "cannot undo")
+            continue
+        _, move = history.pop()
+        for cell in move_cells(move):
+            del board[cell]
+        respond(True)
+    elif command == "clear_board":
+        board.clear()
+        history.clear()
+        respond(True)
+    elif command == "all_legal":
+        respond(True, "\n".join(legal_moves(int(args[0]))))
+    elif command == "reg_genmove":
+        moves = legal_moves(int(args[0]))
+        respond(bool(moves), moves[0] if moves else "no legal moves")
+    elif command == "showboard":
+        respond(True, show_board())
+    elif command == "final_score":
+        respond(True, " ".join(str(sum(1 for p in board.values() if p == pid)) for pid in range(1, 5)))
+    elif command == "savesgf":
+        with open(args[0], "w") as f:
+            f.write("(\n;GM[Blokus]\n" + "".join(f";{pid}[{move}]\n" for pid, move in history) + ")\n")
+        respond(True)
+    elif command == "loadsgf":
+        board.clear()
+        history.clear()
+        with open(args[0]) as f:
+            for pid, move in re.findall(r";([1-4])\[([^\]]*)\]", f.read()):
+                place(int(pid), move)
+        respond(True)
+    elif command == "stub_echo":
+        respond(True, "x" * int(args[0]))
+    elif command == "quit":
+        respond(True)
+        break
+    else:
+        respond(False, "unknown command")
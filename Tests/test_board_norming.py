@@ -0,0 +1,31 @@
+import numpy as np
+from BlokusPentobi.board_norming import normalize_board_to_perspective, rotate_board_to_perspective
+
+def _old_normalize_board_to_perspective(board, perspective_pid):
+    """ The original formula: shift the colors with mod 4, restore the empty cells, and rotate.
+    """
+    mask = board == -1
+    board = np.mod(board + (4 - np.full(board.shape, perspective_pid)), 4)
+    board = np.where(mask, -1, board)
+    corner_pids = [board[0, 0], board[0, -1], board[-1, -1], board[-1, 0]]
+    corner_index = corner_pids.index(0) if 0 in corner_pids else 0
+    return np.rot90(board, k=corner_index)
+
+def test_normalize_board_to_perspective_matches_the_old_formula():
+    rng = np.random.default_rng(0)
+    for _ in range(50):
+        board = rng.integers(-1, 4, size=(20, 20)).astype(np.int8)
+        for pid in range(4):
+            normalized = normalize_board_to_perspective(board, pid)
+            assert normalized.dtype == np.int8
+            assert np.array_equal(normalized, _old_normalize_board_to_perspective(board, pid))
+
+def test_rotate_board_to_perspective():
+    board = np.full((20, 20), -1, dtype=np.int8)
+    board[0, 0], board[0, -1], board[-1, -1], board[-1, 0] = 0, 1, 2, 3
+    for pid in range(4):
+        rotated = rotate_board_to_perspective(board, pid)
+        assert rotated[0, 0] == pid
+        assert rotated.flags.c_contiguous
+    # If no corner has the pid, the board is not rotated
+    assert np.array_equal(rotate_board_to_perspective(board, 5), board)
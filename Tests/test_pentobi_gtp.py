@@ -0,0 +1,112 @@
+import os
+import random
+import stat
+import pytest
+from BlokusPentobi.PentobiGTP import PentobiGTP, PASS
+from BlokusPentobi.utils import parse_gtp_board_to_matrix
+
+STUB_GTP = os.path.join(os.path.dirname(os.path.abspath(__file__)), "stub_pentobi_gtp.py")
+
+@pytest.fixture
+def new_session(monkeypatch):
+    """ Start PentobiGTP sessions on the stub engine, where each player can place two pieces.
+    The sessions are closed after the test.
+    """
+    monkeypatch.setenv("STUB_PENTOBI_PIECES", "2")
+    os.chmod(STUB_GTP, os.stat(STUB_GTP).st_mode | stat.S_IXUSR)
+    sessions = []
+    def start():
+        sessions.append(PentobiGTP(gtp_path=STUB_GTP))
+        return sessions[-1]
+    yield start
+    for sess in sessions:
+        sess.close()
+
+def _play_random_game(sess, seed=0):
+    rng = random.Random(seed)
+    while not sess.is_game_finished():
+        pid = sess.current_player
+        sess.play_move(pid, rng.choice(sess.get_legal_moves(pid)))
+
+def _engine_has_no_moves(sess):
+    return all(sess.get_legal_moves(pid) == [PASS] for pid in range(1, 5))
+
+def _assert_in_sync_with_engine(sess):
+    assert (sess.board == parse_gtp_board_to_matrix(sess.send_command("showboard"))).all()
+
+def test_game_is_finished_after_four_passes(new_session):
+    sess = new_session()
+    _play_random_game(sess)
+    assert sess.move_history[-4:] == [(pid, PASS) for pid in (1, 2, 3, 4)]
+    assert _engine_has_no_moves(sess)
+    _assert_in_sync_with_engine(sess)
+
+def test_undo_across_passes(new_session):
+    sess = new_session()
+    _play_random_game(sess)
+    n_moves = len(sess.move_history)
+    sess.undo_last_move()
+    assert not sess.is_game_finished()
+    assert sess.current_player == 4
+    # Undo the passes, and the last real move, which is also undone in the engine
+    for _ in range(4):
+        sess.undo_last_move()
+    assert len(sess.move_history) == n_moves - 5
+    assert sess.move_history[-1][1] != PASS
+    assert not sess.is_game_finished()
+    _assert_in_sync_with_engine(sess)
+    # Playing on finishes the game again
+    _play_random_game(sess, seed=1)
+    assert sess.is_game_finished() and _engine_has_no_moves(sess)
+    _assert_in_sync_with_engine(sess)
+
+def test_load_sgf_then_passes(new_session, tmp_path):
+    sess, loaded = new_session(), new_session()
+    _play_random_game(sess)
+    # Passes are not saved in the file, so they are not known after loading it
+    sgf_file = str(tmp_path / "finished.blksgf")
+    sess.save_sgf(sgf_file)
+    loaded.load_sgf(sgf_file)
+    assert all(move != PASS for _, move in loaded.move_history)
+    assert loaded.is_game_finished()
+    _assert_in_sync_with_engine(loaded)
+    # A state where only some players have passed
+    while sess.move_history[-1][1] == PASS or sess.move_history[-1][0] != 2:
+        sess.undo_last_move()
+    sess.save_sgf(sgf_file)
+    loaded.load_sgf(sgf_file)
+    loaded.current_player = sess.current_player
+    assert not loaded.is_game_finished()
+    # The game ends after four passes in a row, which are counted from the loaded state
+    n_loaded = len(loaded.move_history)
+    _play_random_game(loaded)
+    assert len(loaded.move_history) > n_loaded + 4
+    assert loaded.move_history[-4:] == [(pid, PASS) for pid in (1, 2, 3, 4)]
+    assert _engine_has_no_moves(loaded)
+    _assert_in_sync_with_engine(loaded)
+
+def test_set_to_state(new_session):
+    sess, copy = new_session(), new_session()
+    rng = random.Random(2)
+    while not sess.is_game_finished():
+        pid = sess.current_player
+        sess.play_move(pid, rng.choice(sess.get_legal_moves(pid)))
+        copy.set_to_state(sess)
+        assert copy.move_history == sess.move_history
+        assert copy.current_player == sess.current_player
+        assert copy.board_hash == sess.board_hash
+        assert (copy.board == sess.board).all()
+        assert copy.is_game_finished() == sess.is_game_finished()
+        _assert_in_sync_with_engine(copy)
+    # The copy continues independently of the original
+    copy.undo_last_move()
+    assert not copy.is_game_finished() and sess.is_game_finished()
+
+def test_responses_longer_than_one_read(new_session):
+    sess = new_session()
+    # A read returns at most 64 KiB, so these responses are split over several reads
+    assert sess.send_command("stub_echo 70000") == "= " + "x" * 70000
+    responses = sess.send_commands_batch(["stub_echo 65535", "stub_echo 3", "stub_echo 131072"])
+    assert [len(r) for r in responses] == [65537, 5, 131074]
+    # Nothing is left over for the next command
+    assert sess.send_command("stub_echo 1") == "= x"
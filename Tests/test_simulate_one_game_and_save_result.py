@@ -1,24 +1,51 @@
+import os
+import pathlib
+import tempfile
 import time
 from BlokusPentobi.PentobiPlayers import PentobiInternalPlayer
-from BlokusPentobi.simulate import play_game_with_args_and_save_result
+from BlokusPentobi.simulate import play_games_in_parallel, play_game_with_args_and_save_result
 
-players = [PentobiInternalPlayer(pid=1, level=6, name="P1"),
-           PentobiInternalPlayer(pid=2, level=1, name="P2"),
-           PentobiInternalPlayer(pid=3, level=1, name="P3"),
-           PentobiInternalPlayer(pid=4, level=1, name="P4")
-           ]
+players_spec = [(PentobiInternalPlayer, {"pid":1, "level":6, "name":"P1"}),
+                (PentobiInternalPlayer, {"pid":2, "level":1, "name":"P2"}),
+                (PentobiInternalPlayer, {"pid":3, "level":1, "name":"P3"}),
+                (PentobiInternalPlayer, {"pid":4, "level":1, "name":"P4"})
+                ]
 
 game_kwargs_list = [{},
                     {"level":5},
                     {"threads":4, "level":5},
                     {"nobook":True, "noresign":False},
 ]
-times_taken = []
-for i, game_kwargs in enumerate(game_kwargs_list):
+
+def _assert_is_score(score):
+    assert len(score) == 4
+    assert all(isinstance(sc, int) for sc in score)
+
+def test_simulate_one_game_and_save_result(tmp_path):
+    players = [player_class(**player_kwargs) for player_class, player_kwargs in players_spec]
+    for i, game_kwargs in enumerate(game_kwargs_list):
+        result_file = str(tmp_path / f"test_{i}.blksgf")
+        start_t = time.time()
+        game = play_game_with_args_and_save_result(players, game_kwargs, verbose=False, timeout=60, result_file=result_file)
+        end_t = time.time()
+        print(f"Game {i} took {end_t - start_t} seconds")
+        assert os.path.isfile(result_file)
+        _assert_is_score(game.score)
+        game.close()
+
+def test_simulate_games_in_parallel_and_save_results(tmp_path):
+    games = [(players_spec, game_kwargs, str(tmp_path / f"test_{i}.blksgf")) for i, game_kwargs in enumerate(game_kwargs_list)]
     start_t = time.time()
-    play_game_with_args_and_save_result(players, game_kwargs, verbose=False, timeout=60, result_file="test.blksgf")
+    scores = play_games_in_parallel(games, n_workers=len(games))
     end_t = time.time()
-    times_taken.append(end_t - start_t)
-    print(f"Game {i} took {end_t - start_t} seconds")
+    for i, score in enumerate(scores):
+        print(f"Game {i} score: {score}")
+    print(f"Time taken: {end_t - start_t} seconds")
+    assert len(scores) == len(games)
+    for (_, _, result_file), score in zip(games, scores):
+        assert os.path.isfile(result_file)
+        _assert_is_score(score)
 
-print(f"Times taken: {times_taken}")
+if __name__ == "__main__":
+    test_simulate_one_game_and_save_result(pathlib.Path(tempfile.mkdtemp()))
+    test_simulate_games_in_parallel_and_save_results(pathlib.Path(tempfile.mkdtemp()))
@@ -0,0 +1,69 @@
+import os
+import numpy as np
+from BlokusPentobi.utils import (parse_gtp_board_to_matrix, parse_blksgf_moves, move_to_cell_indices,
+                                 move_to_bitmask, zobrist_hash, move_zobrist_delta, bitboards_to_matrix,
+                                 BITBOARD_WORDS, EMPTY_BOARD_HASH)
+
+EXAMPLE_SGF = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "example.blksgf")
+
+def _example_moves():
+    with open(EXAMPLE_SGF) as f:
+        return parse_blksgf_moves(f.read())
+
+def _board_to_gtp_text(board, padded=True):
+    """ Print the board like the 'showboard' command, with a marker on the last move and text after some rows.
+    """
+    lines = ["= "]
+    for i, row in enumerate(board):
+        row_number = 20 - i
+        label = f"{row_number:2d}" if padded else f"{row_number}"
+        cells = ["." if v == -1 else "XO#@"[v] for v in row]
+        line = f"{label} " + " ".join(cells)
+        if i == 10:
+            # The last move is marked in the separators between the cells
+            line = line[:len(label) + 4] + ">" + line[len(label) + 5:]
+        if i % 4 == 0:
+            line += "  Blue(X): 82!"
+        lines.append(line)
+    lines.append("   A B C D E F G H I J K L M N O P Q R S T")
+    return "\n".join(lines) + "\n"
+
+def test_parse_blksgf_moves():
+    moves = _example_moves()
+    assert len(moves) == 66
+    assert moves[0] == (1, "c18,c19,a20,b20,c20")
+    assert moves[1] == (2, "r18,s18,s19,s20,t20")
+    assert moves[-1] == (1, "i15")
+    assert all(pid in (1, 2, 3, 4) for pid, _ in moves)
+
+def test_bitboards_and_zobrist_hash_match_the_board():
+    board = np.full((20, 20), -1, dtype=np.int8)
+    bitboards = np.zeros((4, BITBOARD_WORDS), dtype=np.uint64)
+    board_hash = EMPTY_BOARD_HASH
+    assert zobrist_hash(board) == EMPTY_BOARD_HASH
+    for pid, move in _example_moves():
+        board.flat[move_to_cell_indices(move)] = pid - 1
+        bitboards[pid - 1] |= move_to_bitmask(move)
+        board_hash ^= move_zobrist_delta(move, pid - 1)
+        assert np.array_equal(bitboards_to_matrix(bitboards), board)
+        assert board_hash == zobrist_hash(board)
+    # Removing the moves in reverse order returns to the empty board
+    for pid, move in reversed(_example_moves()):
+        bitboards[pid - 1] ^= move_to_bitmask(move)
+        board_hash ^= move_zobrist_delta(move, pid - 1)
+    assert not bitboards.any()
+    assert board_hash == EMPTY_BOARD_HASH
+
+def test_move_to_cell_indices():
+    # The first row of the matrix is row 20 of the board
+    assert list(move_to_cell_indices("a20")) == [0]
+    assert list(move_to_cell_indices("t1,a1")) == [399, 380]
+
+def test_parse_gtp_board_to_matrix():
+    board = np.full((20, 20), -1, dtype=np.int8)
+    for pid, move in _example_moves():
+        board.flat[move_to_cell_indices(move)] = pid - 1
+    for padded in (True, False):
+        parsed = parse_gtp_board_to_matrix(_board_to_gtp_text(board, padded=padded))
+        assert parsed.dtype == np.int8
+        assert np.array_equal(parsed, board)